@@ -0,0 +1,226 @@
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import guestfs
+
+logger = logging.getLogger(__name__)
+
+"""
+Manages a fixed libguestfs appliance so containers don't rebuild the supermin
+appliance on every first launch(). The appliance is built once with
+libguestfs-make-fixed-appliance into a directory keyed on the libguestfs
+version and the kernel supermin bundles, then LIBGUESTFS_PATH is pointed at it.
+
+https://libguestfs.org/guestfs-internals.1.html#fixed-appliance
+"""
+CACHE_DIR = pathlib.Path(
+    os.environ.get(
+        "APPLIANCE_CACHE_DIR",
+        pathlib.Path.home() / ".cache" / "disk-image-tools" / "appliance",
+    )
+)
+APPLIANCE_FILES = ("kernel", "initrd", "root", "README.fixed")
+STAMP_FILE = "appliance.key"
+# Leftover .build-*/.stale-* dirs older than this are from killed runs
+STALE_TEMP_AGE = 60 * 60
+# Appliances for other keys are kept while recently used by another image
+STALE_APPLIANCE_AGE = 7 * 24 * 60 * 60
+
+timings: typing.Dict[str, float] = {}
+status = "disabled"
+
+
+def guestfs_version() -> typing.Dict[str, typing.Any]:
+    return guestfs.GuestFS().version()
+
+
+def appliance_key(version: typing.Dict[str, typing.Any] = None) -> str:
+    """
+    Builds a cache key that changes whenever the appliance needs rebuilding
+    :param version: result of guestfs.GuestFS().version()
+    :return: directory-safe key (i.e. 1.42.0-5.8.9-200.fc32.x86_64)
+    """
+    version = version or guestfs_version()
+    key = "{major}.{minor}.{release}{extra}".format(**version)
+    # supermin copies the kernel from the image's /lib/modules (not the
+    # running host kernel) so the appliance stays valid on any Docker host
+    kernel = os.environ.get("SUPERMIN_KERNEL_VERSION")
+    if not kernel:
+        try:
+            kernel = "+".join(sorted(os.listdir("/lib/modules")))
+        except OSError:
+            kernel = ""
+    return f"{key}-{kernel or 'unknown'}-{os.uname().machine}".replace(os.sep, "_")
+
+
+def is_valid(appliance_dir: pathlib.Path, key: str) -> bool:
+    """
+    Cheap sanity check that doesn't launch the appliance
+    :param appliance_dir: directory containing a fixed appliance
+    :param key: expected appliance key
+    :return: True if the appliance can be used as-is
+    """
+    try:
+        if (appliance_dir / STAMP_FILE).read_text().strip() != key:
+            return False
+        return all((appliance_dir / f).stat().st_size > 0 for f in APPLIANCE_FILES)
+    except OSError:
+        return False
+
+
+def build_appliance(appliance_dir: pathlib.Path, key: str) -> None:
+    """
+    Builds a fixed appliance in a temporary directory then moves it into place.
+    A valid appliance is never replaced since another run may be launching from it
+    :param appliance_dir: final location of the appliance
+    :param key: appliance key to stamp the build with
+    :return:
+    """
+    logger.info("Building fixed libguestfs appliance in %s", appliance_dir)
+    appliance_dir.parent.mkdir(parents=True, exist_ok=True)
+    build_dir = pathlib.Path(
+        tempfile.mkdtemp(prefix=".build-", dir=appliance_dir.parent)
+    )
+    try:
+        subprocess.check_output(
+            ["libguestfs-make-fixed-appliance", str(build_dir)],
+            stderr=subprocess.STDOUT,
+        )
+        (build_dir / STAMP_FILE).write_text(key)
+        # mkdtemp creates 0700 dirs. Let other uids sharing the cache read it
+        os.chmod(build_dir, 0o755)
+
+        if is_valid(appliance_dir, key):
+            logger.info("Appliance was built concurrently. Using existing copy")
+            return
+
+        if appliance_dir.exists():
+            stale_dir = tempfile.mkdtemp(prefix=".stale-", dir=appliance_dir.parent)
+            logger.info("Moving invalid appliance aside to %s", stale_dir)
+            os.rename(appliance_dir, pathlib.Path(stale_dir) / appliance_dir.name)
+
+        try:
+            os.rename(build_dir, appliance_dir)
+        except OSError:
+            if not is_valid(appliance_dir, key):
+                raise
+            logger.info("Appliance was built concurrently. Using existing copy")
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def prune(keep: str) -> None:
+    """
+    Removes leftover temporary dirs and appliances for other keys
+    that haven't been used recently
+    :param keep: key of the appliance in use
+    :return:
+    """
+    now = time.time()
+    for path in CACHE_DIR.iterdir():
+        if not path.is_dir() or path.name == keep:
+            continue
+        try:
+            if path.name.startswith((".build-", ".stale-")):
+                max_age, last_used = STALE_TEMP_AGE, path.stat().st_mtime
+            elif path.name.startswith("."):
+                continue
+            elif (path / STAMP_FILE).exists():
+                max_age = STALE_APPLIANCE_AGE
+                last_used = (path / STAMP_FILE).stat().st_mtime
+            else:
+                max_age, last_used = STALE_APPLIANCE_AGE, path.stat().st_mtime
+        except OSError:
+            continue
+        if now - last_used > max_age:
+            logger.info("Removing stale appliance directory %s", path)
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def ensure_appliance(
+    version: typing.Dict[str, typing.Any] = None
+) -> typing.Optional[str]:
+    """
+    Validates the cached appliance (building it if needed) and
+    points libguestfs at it through LIBGUESTFS_PATH. If the appliance
+    can't be built, LIBGUESTFS_PATH is left alone so libguestfs falls
+    back to building its supermin appliance
+    :param version: result of guestfs.GuestFS().version()
+    :return: path to the fixed appliance or None if it isn't used
+    """
+    global status
+    start = time.monotonic()
+    key = appliance_key(version)
+    appliance_dir = CACHE_DIR / key
+
+    if is_valid(appliance_dir, key):
+        logger.info("Using cached libguestfs appliance %s", appliance_dir)
+        status = "hit"
+        # Mark the appliance as in use so other images sharing the cache keep it
+        try:
+            os.utime(appliance_dir / STAMP_FILE)
+        except OSError:
+            pass
+    else:
+        logger.info("No valid appliance cached for %s", key)
+        try:
+            build_appliance(appliance_dir, key)
+        except subprocess.CalledProcessError as e:
+            logger.warning(
+                "Failed to build fixed appliance. Falling back to supermin appliance\n%s",
+                e.output.decode(errors="replace") if e.output else e,
+            )
+            status = "failed"
+        except OSError as e:
+            logger.warning(
+                "Failed to build fixed appliance. Falling back to supermin appliance: %s",
+                e,
+            )
+            status = "failed"
+        else:
+            status = "rebuilt"
+
+    try:
+        prune(key)
+    except OSError as e:
+        logger.warning("Failed to prune appliance cache: %s", e)
+
+    timings["appliance"] = time.monotonic() - start
+    logger.info("Appliance %s in %.2fs", status, timings["appliance"])
+    if status == "failed":
+        return None
+
+    os.environ["LIBGUESTFS_PATH"] = str(appliance_dir)
+    return str(appliance_dir)
+
+
+def timed_launch(g: guestfs.GuestFS) -> None:
+    start = time.monotonic()
+    g.launch()
+    elapsed = time.monotonic() - start
+    timings["launch"] = timings.get("launch", 0) + elapsed
+    logger.info("Appliance launched in %.2fs", elapsed)
+
+
+def report() -> None:
+    logger.info(
+        "libguestfs startup breakdown: appliance cache %s, %s (total %.2fs)",
+        status,
+        ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()),
+        sum(timings.values()),
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    appliance = ensure_appliance()
+    if appliance is None:
+        sys.exit(1)
+    print(appliance)
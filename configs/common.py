@@ -14,6 +14,8 @@ import guestfs
 import requests
 import ruamel.yaml
 
+from configs.appliance import timed_launch
+
 logger = logging.getLogger(__name__)
 
 
@@ -75,7 +77,7 @@ def mount(working_image: str) -> guestfs.GuestFS:
     g.set_backend("direct")
     g.set_network(True)  # enable networking
 
-    g.launch()
+    timed_launch(g)
     g.inspect_os()
 
     roots = g.inspect_get_roots()
@@ -213,7 +215,7 @@ def build_esp(image_file: str) -> None:
         preallocation="metadata",
     )
     target.add_drive_opts(new_image_file, readonly=False)
-    target.launch()
+    timed_launch(target)
 
     # logger.info("Partitioning output image")
     # target.part_disk("/dev/sda", "gpt")
@@ -6,9 +6,7 @@ import subprocess
 import sys
 import typing
 
-import guestfs
-
-import configs.centos, configs.ubuntu
+import configs.appliance, configs.centos, configs.ubuntu
 from configs.common import guess_image_format
 
 logging.basicConfig(
@@ -46,7 +44,7 @@ sudo dnf install --allowerasing \
     https://download-ib01.fedoraproject.org/pub/fedora/linux/releases/32/Everything/x86_64/os/Packages/l/libguestfs-tools-c-1.42.0-2.fc32.x86_64.rpm \
     https://download-ib01.fedoraproject.org/pub/fedora/linux/releases/32/Everything/x86_64/os/Packages/l/libguestfs-xfs-1.42.0-2.fc32.x86_64.rpm
 """
-guestfs_version = guestfs.GuestFS().version()
+guestfs_version = configs.appliance.guestfs_version()
 assert guestfs_version["major"] == 1
 assert guestfs_version["minor"] >= 42
 
@@ -95,17 +93,29 @@ if __name__ == "__main__":
         help="The name of the image to create",
     )
 
+    parser.add_argument(
+        "--no-appliance-cache",
+        action="store_true",
+        help="Let libguestfs build its own supermin appliance instead of using the cached fixed appliance",
+    )
+
     args = parser.parse_args()
 
     working_dir = args.work_dir or os.environ.get("WORK_DIR")
     if working_dir:
         os.chdir(working_dir)
 
-    if args.image == "ubuntu":
-        ubuntu_codename = configs.ubuntu.get_lts_codename()
-        image = configs.ubuntu.build(ubuntu_codename)
-    elif args.image == "centos":
-        image = configs.centos.build()
+    if not args.no_appliance_cache:
+        configs.appliance.ensure_appliance(guestfs_version)
+
+    try:
+        if args.image == "ubuntu":
+            ubuntu_codename = configs.ubuntu.get_lts_codename()
+            image = configs.ubuntu.build(ubuntu_codename)
+        elif args.image == "centos":
+            image = configs.centos.build()
+    finally:
+        configs.appliance.report()
 
     if args.resize:
         logger.info("Resizing image %s by %s", image, args.resize)
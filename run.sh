@@ -4,5 +4,9 @@ set -e
 
 CONTAINER_TOOL=docker
 IMAGE_NAME=disk-image-tools
+APPLIANCE_VOLUME=disk-image-tools-appliance
 [ -f "Dockerfile" ] && "$CONTAINER_TOOL" build -t "$IMAGE_NAME" .
-"$CONTAINER_TOOL" run -it --rm -v "$(pwd)":/image:rw "$IMAGE_NAME"
+"$CONTAINER_TOOL" run -it --rm \
+    -v "$(pwd)":/image:rw \
+    -v "$APPLIANCE_VOLUME":/home/build/.cache/disk-image-tools/appliance:rw \
+    "$IMAGE_NAME"